@@ -1,35 +1,89 @@
 # api/index.py
 # Versão Flask pronta para Render
-# Todas as rotas originais mantidas, processamento em memória e templates via render_template_string
+# Todas as rotas originais mantidas, processamento em memória e templates compilados uma única vez
 
 import os
+import csv
+import functools
+from collections import Counter
 import pandas as pd
-from io import BytesIO, StringIO
-from flask import Flask, request, send_file, render_template_string, jsonify
-from utils import parse_whatsapp_txt, analyze_keywords, highlight_lines
+from io import BytesIO, TextIOWrapper
+import orjson
+from flask import Flask, request, send_file, jsonify
+from flask.json.provider import DefaultJSONProvider
+from jinja2 import DictLoader
+from utils import parse_whatsapp_txt, prep_keywords, analyze_keywords, highlight_lines
 import traceback
 import sys
 
 # --------------------------
 # App Flask
 # --------------------------
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON do Flask (jsonify e filtro tojson dos templates) serializado com orjson"""
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=str, option=option).decode()
+
 app = Flask(__name__)
+# precisa ser definido antes de app.jinja_env ser criado (o tojson usa app.json.dumps)
+app.json = OrjsonProvider(app)
 
 BASE_DIR = os.path.join(os.path.dirname(__file__), "..")
 
+TEMPLATE_NAMES = ("index.html", "report.html")
+
 def load_template(name):
     """Carrega template HTML manualmente"""
     path = os.path.join(BASE_DIR, "templates", name)
     with open(path, "r", encoding="utf-8") as f:
         return f.read()
 
+# Templates lidos do disco uma única vez no import; o ambiente herda os filtros
+# do Flask (tojson etc.) e mantém os templates compilados em cache
+_env = app.jinja_env.overlay(
+    loader=DictLoader({name: load_template(name) for name in TEMPLATE_NAMES}),
+    auto_reload=False,
+    cache_size=-1,
+)
+
+@functools.cache
+def _get_template(name):
+    """Retorna o template já compilado (mesmo objeto em todas as requisições)"""
+    return _env.get_template(name)
+
+# compila todos os templates já no import, fora do caminho da requisição
+for _name in TEMPLATE_NAMES:
+    _get_template(_name)
+
+def _chart_data(report):
+    """Contagem de ocorrências por dia para o gráfico"""
+    counts = sorted(Counter(m['date_iso'] for item in report for m in item['matches']).items())
+    return {'date': [d for d, _ in counts], 'count': [c for _, c in counts]}
+
+def _render_report(report, highlighted, chart_data):
+    """Renderiza o relatório com o template pré-compilado"""
+    return _get_template("report.html").render(report=report, text_lines=highlighted, chart_data=chart_data)
+
+def _flatten_report(report):
+    """Linhas planas do relatório: a lista de matches vira um texto com os trechos"""
+    for item in report:
+        row = dict(item)
+        if "matches" in row:
+            row["matches"] = " | ".join(str(m.get("text_excerpt", "")) for m in row["matches"] or [])
+        yield row
+
 # --------------------------
 # Rotas
 # --------------------------
 @app.route("/", methods=["GET"])
 def form():
-    html = load_template("index.html")
-    return render_template_string(html)
+    return _get_template("index.html").render()
 
 @app.route("/analyze", methods=["POST"])
 def analyze():
@@ -41,26 +95,15 @@ def analyze():
         if not file:
             return "Arquivo ausente", 400
 
-        text_bytes = file.read().decode("utf-8", errors="ignore")
-        messages = parse_whatsapp_txt(StringIO(text_bytes))
+        messages = parse_whatsapp_txt(file.stream)
         keywords = [k.strip() for k in keywords_raw.splitlines() if k.strip()]
 
-        report = analyze_keywords(messages, keywords, fuzzy_threshold=fuzzy)
-        highlighted = highlight_lines(messages, keywords)
-
-        # gerar dados do gráfico
-        rows = []
-        for item in report:
-            for m in item['matches']:
-                dt = m['date'].date() if m['date'] else None
-                rows.append({'date': str(dt) if dt else 'unknown'})
-        df = pd.DataFrame(rows)
-        chart_df = df.groupby('date').size().reset_index(name='count') if not df.empty else pd.DataFrame({'date':[],'count':[]})
-
-        html = load_template("report.html")
-        rendered = render_template_string(html, report=report, text_lines=highlighted, chart_data=chart_df.to_dict("list"))
+        # automato/regex das keywords montados uma vez e usados nas duas etapas
+        prepped = prep_keywords(keywords)
+        report = analyze_keywords(messages, keywords, fuzzy_threshold=fuzzy, prepped=prepped)
+        highlighted = highlight_lines(messages, keywords, prepped=prepped)
 
-        return rendered
+        return _render_report(report, highlighted, _chart_data(report))
     except Exception as e:
         print("[ERROR] /analyze:", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
@@ -72,9 +115,16 @@ def export_csv():
     if "report" not in data:
         return jsonify({"error": "Dados ausentes"}), 400
 
-    df = pd.json_normalize(data["report"])
+    report = data["report"]
     buf = BytesIO()
-    df.to_csv(buf, index=False, encoding="utf-8-sig")
+    # csv gravado direto no buffer (sem montar DataFrame)
+    out = TextIOWrapper(buf, encoding="utf-8-sig", newline="", write_through=True)
+    writer = csv.writer(out, lineterminator="\n")
+    if report:
+        columns = list(report[0].keys())
+        writer.writerow(columns)
+        writer.writerows([row.get(c, "") for c in columns] for row in _flatten_report(report))
+    out.detach()
     buf.seek(0)
     return send_file(buf, mimetype="text/csv", as_attachment=True, download_name="relatorio.csv")
 
@@ -84,9 +134,12 @@ def export_excel():
     if "report" not in data:
         return jsonify({"error": "Dados ausentes"}), 400
 
-    df = pd.json_normalize(data["report"])
+    # registros já planos (mesmas colunas do CSV), sem json_normalize
+    df = pd.DataFrame.from_records(list(_flatten_report(data["report"])))
     buf = BytesIO()
-    df.to_excel(buf, index=False)
+    # engine xlsxwriter, montando o arquivo em memória (sem arquivos temporários)
+    with pd.ExcelWriter(buf, engine="xlsxwriter", engine_kwargs={"options": {"in_memory": True}}) as writer:
+        df.to_excel(writer, index=False)
     buf.seek(0)
     return send_file(buf, mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                      as_attachment=True, download_name="relatorio.xlsx")
@@ -3,68 +3,110 @@
 # Compatível com leitura de arquivos em memória ou disco
 # Comentado e seguro para evitar crashes
 
+import io
 import re
-from datetime import datetime
-from rapidfuzz import fuzz
+import ahocorasick
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz, process
 
-# --------- Padrões de data do WhatsApp ---------
-PATTERN1 = re.compile(r'^(\d{1,2}/\d{1,2}/\d{2,4})\s+(\d{1,2}:\d{2})(?:\s*-\s*)(.*?):\s*(.*)$')
-PATTERN2 = re.compile(r'^(\d{1,2}/\d{1,2}/\d{2,4}),\s*(\d{1,2}:\d{2})\s*-\s*(.*?):\s*(.*)$')
+# --------- Padrão de data do WhatsApp ---------
+# "dd/mm/aa hh:mm - autor: texto", com ou sem vírgula após a data
+PATTERN = re.compile(r'^(\d{1,2}/\d{1,2}/\d{2,4})(?:,\s*|\s+)(\d{1,2}:\d{2}(?::\d{2})?)\s*-\s*(.*?):\s*(.*)$')
+
+DATE_FORMATS = (
+    "%d/%m/%Y %H:%M",
+    "%d/%m/%y %H:%M",
+    "%d/%m/%Y %H:%M:%S",
+    "%d/%m/%y %H:%M:%S",
+)
 
 
 # ----------------- Parse de data -----------------
-def _try_parse_date(date_str):
-    for fmt in (
-        "%d/%m/%Y %H:%M",
-        "%d/%m/%y %H:%M",
-        "%d/%m/%Y %H:%M:%S",
-        "%d/%m/%y %H:%M:%S",
-    ):
-        try:
-            return datetime.strptime(date_str, fmt)
-        except:
-            continue
-    return None
+def _parse_dates(date_strs):
+    """
+    Converte todas as datas de uma vez (vetorizado no pandas).
+    Cada formato é tentado apenas nas posições que ainda não foram convertidas.
+    Retorno: (lista de datetime, lista de 'YYYY-MM-DD'); None / 'unknown' quando nenhum formato serve
+    """
+    strs = pd.Series(date_strs, dtype=object)
+    parsed = pd.Series(pd.NaT, index=strs.index, dtype="datetime64[ns]")
+    for fmt in DATE_FORMATS:
+        missing = parsed.isna()
+        if not missing.any():
+            break
+        parsed[missing] = pd.to_datetime(strs[missing], format=fmt, errors="coerce")
+    # conversão para datetime do Python e para o dia em texto de uma vez só, sem laço por elemento
+    missing = parsed.isna().to_numpy()
+    dates = pd.DatetimeIndex(parsed).to_pydatetime()
+    dates[missing] = None
+    date_isos = np.datetime_as_string(parsed.to_numpy(), unit="D")
+    date_isos[missing] = "unknown"
+    return dates.tolist(), date_isos.tolist()
 
 
 # ----------------- Parse do TXT -----------------
 def parse_whatsapp_txt(file_or_path):
     """
     Lê arquivo TXT (WhatsApp) e separa mensagens.
-    file_or_path: pode ser path string ou arquivo-like (StringIO)
-    Retorno: lista de dicts {'id', 'date', 'author', 'text'}
+    file_or_path: pode ser path string, arquivo-like de texto (StringIO)
+    ou binário (ex.: stream do upload), lido linha a linha;
+    arquivos-like são devolvidos no início (seek(0)) quando suportam seek
+    Retorno: lista de dicts {'id', 'date', 'date_iso', 'author', 'text'}
     """
     if isinstance(file_or_path, str):
         with open(file_or_path, "r", encoding="utf-8", errors="ignore") as f:
-            lines = f.read().splitlines()
+            return _parse_lines(f)
+
+    if isinstance(file_or_path, io.TextIOBase):
+        messages = _parse_lines(file_or_path)
+    elif isinstance(file_or_path, io.IOBase) and file_or_path.readable():
+        # binário: decodifica em streaming, sem carregar o arquivo inteiro
+        stream = io.TextIOWrapper(file_or_path, encoding="utf-8", errors="ignore")
+        try:
+            messages = _parse_lines(stream)
+        finally:
+            # devolve o stream original sem fechá-lo
+            stream.detach()
     else:
-        lines = file_or_path.read().splitlines()
+        # objetos sem a interface io completa (ex.: SpooledTemporaryFile dos uploads
+        # grandes antes do Python 3.11): leitura inteira, como antes
+        content = file_or_path.read()
+        if isinstance(content, bytes):
+            content = content.decode("utf-8", errors="ignore")
+        messages = _parse_lines(content.splitlines())
+
+    if not hasattr(file_or_path, "seekable") or file_or_path.seekable():
         file_or_path.seek(0)
+    return messages
 
+
+def _parse_lines(lines):
     messages = []
     buffer = None
     msg_id = 0
+    # mensagens com cabeçalho e suas datas (texto), convertidas no final
+    dated = []
+    date_strs = []
 
     for raw in lines:
-        line = raw.rstrip("\n")
+        line = raw.rstrip("\r\n")
         if not line.strip():
             continue
 
-        m1 = PATTERN1.match(line)
-        m2 = PATTERN2.match(line)
+        m = PATTERN.match(line)
 
-        if m1 or m2:
+        if m:
             if buffer:
                 messages.append(buffer)
 
             msg_id += 1
-            m = m1 or m2
-            date_str = f"{m.group(1)} {m.group(2)}"
-            date = _try_parse_date(date_str)
             author = m.group(3).strip()
             text = m.group(4).strip()
 
-            buffer = {"id": msg_id, "date": date, "author": author, "text": text}
+            buffer = {"id": msg_id, "date": None, "date_iso": "unknown", "author": author, "text": text}
+            dated.append(buffer)
+            date_strs.append(f"{m.group(1)} {m.group(2)}")
 
         else:
             # Continuação da mensagem anterior
@@ -72,89 +114,221 @@ def parse_whatsapp_txt(file_or_path):
                 buffer["text"] += "\n" + line
             else:
                 msg_id += 1
-                buffer = {"id": msg_id, "date": None, "author": "", "text": line}
+                buffer = {"id": msg_id, "date": None, "date_iso": "unknown", "author": "", "text": line}
 
     if buffer:
         messages.append(buffer)
 
+    if dated:
+        dates, date_isos = _parse_dates(date_strs)
+        # date_iso: dia já formatado, usado na agregação do gráfico
+        for msg, date, date_iso in zip(dated, dates, date_isos):
+            msg["date"] = date
+            msg["date_iso"] = date_iso
+
     return messages
 
 
 # ----------------- Trecho em volta da frase -----------------
-def excerpt(text, phrase, context=50):
-    idx = text.lower().find(phrase.lower())
+def excerpt(text, text_lower, phrase_lower, context=50):
+    """
+    text_lower/phrase_lower já em minúsculo (calculados uma vez pelo chamador).
+    phrase_lower=None: frase sabidamente ausente (match fuzzy), evita a busca no texto
+    """
+    idx = text_lower.find(phrase_lower) if phrase_lower is not None else -1
     if idx == -1:
         return text[: 2 * context] + ("..." if len(text) > context * 2 else "")
 
     start = max(0, idx - context)
-    end = min(len(text), idx + len(phrase) + context)
+    end = min(len(text), idx + len(phrase_lower) + context)
     return ("..." if start > 0 else "") + text[start:end] + ("..." if end < len(text) else "")
 
 
 # ----------------- Busca das keywords -----------------
-def analyze_keywords(messages, keywords, fuzzy_threshold=0.0):
-    result = []
+def _build_automaton(kw_lowers):
+    """Automato Aho-Corasick com todas as keywords em minúsculo (índices por palavra)"""
+    automaton = ahocorasick.Automaton()
+    for i, kw_lower in enumerate(kw_lowers):
+        if kw_lower in automaton:
+            automaton.get(kw_lower).append(i)
+        else:
+            automaton.add_word(kw_lower, [i])
+    automaton.make_automaton()
+    return automaton
 
-    for kw in keywords:
-        matches = []
 
-        # regex exato para frase/palavra (escapando caracteres especiais)
-        exact_pattern = re.compile(re.escape(kw), re.IGNORECASE)
+def prep_keywords(keywords):
+    """
+    Pré-processa as keywords uma única vez para analyze_keywords e highlight_lines.
+    Retorno: dict {'words', 'lowers', 'automaton', 'pattern'} ('pattern' só é compilado sob demanda)
+    """
+    kw_lowers = [kw.lower() for kw in keywords]
+    prepped = {"words": list(keywords), "lowers": kw_lowers, "automaton": None, "pattern": None}
 
-        for msg in messages:
-            text = msg["text"]
-
-            # Busca exata
-            if exact_pattern.search(text):
-                matches.append({
-                    "id": msg["id"],
-                    "date": msg["date"],
-                    "author": msg["author"],
-                    "text_excerpt": excerpt(text, kw),
-                    "score": 100
-                })
-            else:
-                # fuzzy opcional
-                if fuzzy_threshold > 0:
-                    try:
-                        score = fuzz.partial_ratio(kw.lower(), text.lower())
-                        if score >= fuzzy_threshold * 100:
-                            matches.append({
-                                "id": msg["id"],
-                                "date": msg["date"],
-                                "author": msg["author"],
-                                "text_excerpt": excerpt(text, kw),
-                                "score": score
-                            })
-                    except Exception:
-                        # Ignorar problemas de unicode ou strings inválidas
-                        continue
-
-        result.append({
-            "word": kw,
-            "count": len(matches),
-            "matches": matches
-        })
+    if len(keywords) > 1:
+        # uma única varredura por mensagem, independente do número de keywords
+        prepped["automaton"] = _build_automaton(kw_lowers)
+
+    return prepped
 
-    return result
+
+def _highlight_pattern(prepped):
+    """
+    Regex única com todas as keywords, compilada só na primeira vez em que é usada
+    (fallback raro do highlight_lines) e guardada em prepped["pattern"].
+    Mais longas primeiro, para uma keyword curta não "comer" o início de uma mais longa.
+    """
+    if prepped["pattern"] is None:
+        prepped["pattern"] = re.compile(
+            "|".join(sorted(map(re.escape, prepped["words"]), key=len, reverse=True)),
+            re.IGNORECASE
+        )
+    return prepped["pattern"]
+
+
+def _check_prepped(keywords, prepped):
+    """Usa prepped (se passado), garantindo que foi montado com as mesmas keywords"""
+    if prepped is None:
+        return prep_keywords(keywords)
+    if prepped["words"] != list(keywords):
+        raise ValueError("prepped não corresponde às keywords informadas")
+    return prepped
+
+
+def _exact_hits(prepped, text_lower):
+    """Índices das keywords presentes (substring, sem regex) no texto em minúsculo"""
+    automaton = prepped["automaton"]
+    if automaton is None:
+        # caso comum de uma keyword só: str.find direto, sem passar pelo automato
+        return {0} if text_lower.find(prepped["lowers"][0]) != -1 else set()
+
+    hits = set()
+    total = len(prepped["lowers"])
+    for _, indexes in automaton.iter(text_lower):
+        hits.update(indexes)
+        # todas as keywords já encontradas: não precisa percorrer o resto das ocorrências
+        if len(hits) == total:
+            break
+    return hits
+
+
+def _match(msg, kw_lower, score):
+    return {
+        "id": msg["id"],
+        "date": msg["date"],
+        "date_iso": msg["date_iso"],
+        "author": msg["author"],
+        "text_excerpt": excerpt(msg["text"], msg["_text_lower"], kw_lower),
+        "score": score
+    }
+
+
+def analyze_keywords(messages, keywords, fuzzy_threshold=0.0, prepped=None):
+    """prepped: resultado de prep_keywords(keywords), para reaproveitar entre chamadas"""
+    prepped = _check_prepped(keywords, prepped)
+    kw_lowers = prepped["lowers"]
+    matches_by_kw = [[] for _ in keywords]
+
+    if keywords:
+        # texto em minúsculo calculado uma única vez por mensagem
+        text_lowers = []
+        for msg in messages:
+            msg["_text_lower"] = msg["text"].lower()
+            text_lowers.append(msg["_text_lower"])
+
+        # fuzzy opcional: matriz keyword x mensagem calculada de uma vez (em C, multi-thread);
+        # scores abaixo do limite voltam como 0. Acima de 1 nenhum score (máx. 100) alcança o
+        # limite, então só valem os matches exatos (e o cdist rejeitaria score_cutoff > 100)
+        scores = None
+        if 0 < fuzzy_threshold <= 1 and messages:
+            scores = process.cdist(
+                kw_lowers, text_lowers,
+                scorer=fuzz.partial_ratio,
+                score_cutoff=fuzzy_threshold * 100,
+                dtype=np.float64,
+                workers=-1
+            )
+
+        for j, msg in enumerate(messages):
+            hits = _exact_hits(prepped, msg["_text_lower"])
+
+            candidates = hits
+            if scores is not None:
+                candidates = hits.union(np.flatnonzero(scores[:, j]).tolist())
+
+            # percorre apenas as keywords encontradas (exato ou fuzzy)
+            for i in sorted(candidates):
+                # Busca exata
+                if i in hits:
+                    matches_by_kw[i].append(_match(msg, kw_lowers[i], 100))
+                else:
+                    # fuzzy: a keyword não aparece literalmente, trecho do início do texto
+                    matches_by_kw[i].append(_match(msg, None, float(scores[i, j])))
+
+    return [
+        {"word": kw, "count": len(matches), "matches": matches}
+        for kw, matches in zip(keywords, matches_by_kw)
+    ]
 
 
 # ----------------- Highlight no texto -----------------
-def highlight_lines(messages, keywords):
+def _keyword_spans(prepped, text_lower):
+    """Intervalos (início, fim) de todas as ocorrências das keywords, já unidos quando se sobrepõem"""
+    automaton = prepped["automaton"]
+    kw_lowers = prepped["lowers"]
+    spans = []
+
+    if automaton is None:
+        # uma keyword só: str.find sucessivos
+        kw_lower = kw_lowers[0]
+        idx = text_lower.find(kw_lower)
+        while idx != -1:
+            spans.append((idx, idx + len(kw_lower)))
+            idx = text_lower.find(kw_lower, idx + 1)
+    else:
+        for end, indexes in automaton.iter(text_lower):
+            for i in indexes:
+                spans.append((end + 1 - len(kw_lowers[i]), end + 1))
+        spans.sort()
+
+    merged = []
+    for start, end in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def highlight_lines(messages, keywords, prepped=None):
+    """prepped: resultado de prep_keywords(keywords), para reaproveitar entre chamadas"""
+    prepped = _check_prepped(keywords, prepped)
+
     out = []
     for msg in messages:
         txt = msg["text"]
 
-        for kw in keywords:
-            try:
-                txt = re.sub(
-                    re.escape(kw),
-                    lambda x: f"<mark>{x.group(0)}</mark>",
-                    txt,
-                    flags=re.IGNORECASE
-                )
-            except Exception:
-                continue
+        if prepped["words"]:
+            text_lower = msg.get("_text_lower")
+            if text_lower is None:
+                text_lower = txt.lower()
+
+            if len(text_lower) == len(txt):
+                # monta o html em uma passada, com os trechos originais entre <mark>
+                parts = []
+                pos = 0
+                for start, end in _keyword_spans(prepped, text_lower):
+                    parts.append(txt[pos:start])
+                    parts.append(f"<mark>{txt[start:end]}</mark>")
+                    pos = end
+                parts.append(txt[pos:])
+                txt = "".join(parts)
+            else:
+                # lower() mudou o tamanho do texto (alguns caracteres unicode):
+                # as posições não batem com o original, usa a regex.
+                # Obs.: re.IGNORECASE e str.lower() nem sempre concordam (ex.: "İstanbul"
+                # é marcado para a keyword "istanbul", mas analyze_keywords não conta o match)
+                txt = _highlight_pattern(prepped).sub(lambda x: f"<mark>{x.group(0)}</mark>", txt)
 
         txt = txt.replace("\n", "<br>")
 